@@ -4,6 +4,7 @@ from scipy.stats import skew
 import pandas as pd
 import numpy as np
 import warnings
+from joblib import Parallel, delayed
 
 from sklearn.utils import check_array, column_or_1d, assert_all_finite
 from sklearn.utils.validation import check_is_fitted
@@ -13,31 +14,50 @@ from ..utils import sort_columns_logistic, sort_columns_tree
 from ..utils.wrappers import return_frame
 
 
-def _encode_python(values, uniques=None, encode=False, unseen='warn'):
-    """ Modified from the Scikit version except handles unseen values"""
-    if uniques is None:
-        uniques = sorted(set(values))
-        uniques = np.array(uniques, dtype=values.dtype)
-    if encode:
-        table = {val: i for i, val in enumerate(uniques)}
-        try:
-            encoded = np.array([table[v] for v in values])
-        except KeyError as e:
-            c = values.name if hasattr(values, 'name') else 'Column'
-            msg = "{} contains previously unseen labels: {}".format(c, e)
-            if unseen in ('silent', 'warn'):
-                UNSEEN = len(uniques)
-                encoded = np.array([table.get(v, UNSEEN) for v in values])
-                if unseen == 'warn':
-                    warnings.warn(msg)
-            elif unseen == 'raise':
-                raise ValueError(msg)
-            else:
-                raise ValueError('The supported options for `unseen` are: {}'
-                                 .format(['silent', 'warn', 'raise']))
-        return uniques, encoded
+def _handle_unseen(values, encoded, unseen_mask, n_uniques, unseen='warn'):
+    """ Apply the `unseen` policy to the encoded values, unseen values are encoded as n_uniques"""
+    if not unseen_mask.any():
+        return encoded
+
+    c = values.name if hasattr(values, 'name') else 'Column'
+    msg = "{} contains previously unseen labels: {}".format(
+        c, list(pd.unique(np.asarray(values)[unseen_mask])))
+    if unseen in ('silent', 'warn'):
+        if unseen == 'warn':
+            warnings.warn(msg)
+        return np.where(unseen_mask, n_uniques, encoded)
+    elif unseen == 'raise':
+        raise ValueError(msg)
     else:
-        return uniques
+        raise ValueError('The supported options for `unseen` are: {}'
+                         .format(['silent', 'warn', 'raise']))
+
+
+def _check_cols(X: pd.DataFrame, cols, error='warn'):
+    """ Check whether all the columns exist in X with a single pass, return the ones that exist
+    :param error: Specify the action when some of the columns are missing,
+        supported actions are ['raise', 'ignore', 'warn']
+    """
+    existing = set(X.columns)
+    missing = [c for c in cols if c not in existing]
+    if missing:
+        msg = 'Columns {} are not found in the DataFrame'.format(missing)
+        if error == 'raise':
+            raise ValueError(msg)
+        if error == 'warn':
+            warnings.warn(msg)
+    return [c for c in cols if c in existing]
+
+
+def _clip_block(X: pd.DataFrame, cols, lower: pd.Series, upper: pd.Series) -> np.ndarray:
+    """ Clip the numerical columns of X on the underlying numpy array, return the clipped array.
+        Missing bounds are treated as unbounded, same as DataFrame.clip
+    """
+    arr = X[cols].to_numpy(dtype=np.float64, copy=True)
+    lower = lower[cols].fillna(-np.inf).to_numpy()
+    upper = upper[cols].fillna(np.inf).to_numpy()
+    np.clip(arr, lower, upper, out=arr)
+    return arr
 
 
 # A wrapped version of Scikit-Learn preprocessors
@@ -64,27 +84,17 @@ class NormDistOutlierRemover(BaseEstimator, TransformerMixin):
         cols = self.cols or X.columns.tolist()
         self.mean_ = X[cols].mean()
         self.std_ = X[cols].std()
+        self.lower_ = self.mean_ - self.n_sigma * self.std_
+        self.upper_ = self.mean_ + self.n_sigma * self.std_
         return self
 
     def transform(self, X: pd.DataFrame, y=None):
-        check_is_fitted(self, ['mean_', 'std_'])
-        x = X.copy()
-
-        # copy instance variable to local variable
-        _mean, _std, n_sigma = self.mean_, self.std_, self.n_sigma
-
-        for col in self.cols or X.columns:
-            if col not in x:
-                msg = 'Column {} is not found in the DataFrame'.format(col)
-                if self.error == 'raise':
-                    raise ValueError(msg)
-                if self.error == 'warn':
-                    warnings.warn(msg)
-
-            lower_bound = _mean[col] - n_sigma * _std[col]
-            upper_bound = _mean[col] + n_sigma * _std[col]
-            x.loc[x[col] > upper_bound, col] = upper_bound
-            x.loc[x[col] < lower_bound, col] = lower_bound
+        check_is_fitted(self, ['lower_', 'upper_'])
+        cols = _check_cols(X, self.cols or self.lower_.index.tolist(), self.error)
+
+        # only the clipped block is materialized, the rest of the columns are shared with X
+        x = X.copy(deep=False)
+        x[cols] = _clip_block(X, cols, self.lower_, self.upper_)
         return x
 
 
@@ -111,25 +121,18 @@ class IQROutlierRemover(BaseEstimator, TransformerMixin):
         q3 = X[cols].quantile(0.75, interpolation=self.interpolation)
         self.q2 = X[cols].quantile(0.5, interpolation=self.interpolation)
         self.iqr = q3 - q1
+        self.lower_ = self.q2 - self.multiplier * self.iqr
+        self.upper_ = self.q2 + self.multiplier * self.iqr
         return self
 
     def transform(self, X: pd.DataFrame, y=None):
-        check_is_fitted(self, 'iqr')
-        q2, iqr, m = self.q2, self.iqr, self.multiplier
-        x = X.copy()
-
-        for col in self.cols or X.columns:
-            if col not in x:
-                msg = 'Column {} is not found in the DataFrame'.format(col)
-                if self.error == 'raise':
-                    raise ValueError(msg)
-                if self.error == 'warn':
-                    warnings.warn(msg)
-
-            lower_bound = q2[col] - m * iqr[col]
-            upper_bound = q2[col] + m * iqr[col]
-            x.loc[x[col] > upper_bound, col] = upper_bound
-            x.loc[x[col] < lower_bound, col] = lower_bound
+        check_is_fitted(self, ['lower_', 'upper_'])
+
+        cols = _check_cols(X, self.cols or self.lower_.index.tolist(), self.error)
+
+        # only the clipped block is materialized, the rest of the columns are shared with X
+        x = X.copy(deep=False)
+        x[cols] = _clip_block(X, cols, self.lower_, self.upper_)
         return x
 
 
@@ -170,16 +173,23 @@ class QuantileOutlierRemover(BaseEstimator, TransformerMixin):
     
     def transform(self, X: pd.DataFrame, y=None):
         check_is_fitted(self, 'pos_skew_cols')
-        X = X.copy()
-        pos_skew_cols = [c for c in X.columns if c in self.pos_skew_cols]
-        neg_skew_cols = [c for c in X.columns if c in self.neg_skew_cols]
-        
-        upper_threshold, lower_threshold = self.upper_threshold, self.lower_threshold
-        for col in pos_skew_cols:
-            X.loc[X[col] > upper_threshold[col], col] = upper_threshold[col]
-        for col in neg_skew_cols:
-            X.loc[X[col] < lower_threshold[col], col] = lower_threshold[col]
-        return X
+        x = X.copy(deep=False)
+        pos_skew_set, neg_skew_set = set(self.pos_skew_cols), set(self.neg_skew_cols)
+        pos_skew_cols = [c for c in X.columns if c in pos_skew_set]
+        neg_skew_cols = [c for c in X.columns if c in neg_skew_set]
+
+        # np.putmask repeats the thresholds along each row, so every column gets its own threshold
+        if pos_skew_cols:
+            arr = X[pos_skew_cols].to_numpy(dtype=np.float64, copy=True)
+            upper = self.upper_threshold[pos_skew_cols].to_numpy(dtype=np.float64)
+            np.putmask(arr, arr > upper, upper)
+            x[pos_skew_cols] = arr
+        if neg_skew_cols:
+            arr = X[neg_skew_cols].to_numpy(dtype=np.float64, copy=True)
+            lower = self.lower_threshold[neg_skew_cols].to_numpy(dtype=np.float64)
+            np.putmask(arr, arr < lower, lower)
+            x[neg_skew_cols] = arr
+        return x
 
 
 class OrdinalEncoder(BaseEstimator, TransformerMixin):
@@ -207,34 +217,33 @@ class OrdinalEncoder(BaseEstimator, TransformerMixin):
             assert_all_finite(X, allow_nan=False)
 
         self.categories_ = dict()
+        # the string extension dtype converts the whole block at once
+        values = X[cols].astype('string').fillna('_MISSING')
 
         for col in cols:
-            cutoff = _encode_python(X[col].fillna('_MISSING').astype(str))
-            self.categories_[col] = cutoff
+            # sorted unique values through the hashtable in pandas instead of sorted(set(...))
+            uniques = pd.factorize(values[col], sort=True)[1]
+            self.categories_[col] = np.asarray(uniques, dtype=object)
         return self
 
     def transform(self, X: pd.DataFrame, y=None):
         check_is_fitted(self, 'categories_')
-        x = X.copy()
-
-        for col in self.cols or X.columns:
-            if col not in x:
-                msg = 'Column {} is not found in the DataFrame'.format(col)
-                if self.error == 'raise':
-                    raise ValueError(msg)
-                if self.error == 'warn':
-                    warnings.warn(msg)
+        # the encoded columns are replaced as a whole, so a shallow copy is enough
+        x = X.copy(deep=False)
 
+        for col in _check_cols(X, self.cols or list(self.categories_), self.error):
+            values = X[col].astype('string')
             if not self.fill:
-                assert_all_finite(x[col], allow_nan=False)
+                assert_all_finite(X[col], allow_nan=False)
             else:
-                x[col] = x[col].fillna('_MISSING').astype(str)
-            cutoff = self.categories_[col]
-            _, x[col] = _encode_python(x[col], uniques=cutoff, encode=True, unseen=self.unseen)
+                values = values.fillna('_MISSING')
+            cats = self.categories_[col]
+            codes = pd.Index(cats).get_indexer(values).astype(np.int64)
+            x[col] = _handle_unseen(values, codes, codes == -1, len(cats), self.unseen)
         return x
 
     def inverse_transform(self, X: pd.DataFrame, y=None):
-        x = X.copy()
+        x = X.copy(deep=False)
 
         for col in (set(X.columns) & set(self.categories_)):
             mapping = self.categories_[col]
@@ -245,7 +254,8 @@ class OrdinalEncoder(BaseEstimator, TransformerMixin):
 
 class CorrelationRemover(BaseEstimator, TransformerMixin):
 
-    def __init__(self, cols=None, sort=False, categorical_cols=None, threshold=0.8, method='pearson', save_corr=False):
+    def __init__(self, cols=None, sort=False, categorical_cols=None, threshold=0.8, method='pearson', save_corr=False,
+                 n_jobs=None):
         """
         :param cols: A list of feature names, sorted by importance from high to low
         :param sort: Either a boolean, or the method name for sorting, available methods are ['tree', 'chi2']
@@ -253,6 +263,7 @@ class CorrelationRemover(BaseEstimator, TransformerMixin):
         :param threshold: The correlation upper bound
         :param method: The method used for calculating correlation
         :param save_corr: Whether to save the correlation matrix
+        :param n_jobs: The number of threads used for calculating the correlation between categorical columns
         """
         self.cols = cols
         self.sort = sort
@@ -260,27 +271,59 @@ class CorrelationRemover(BaseEstimator, TransformerMixin):
         self.threshold = threshold
         self.method = method
         self.save_corr = save_corr
+        self.n_jobs = n_jobs
         self.num_corr_mat = None
         self.cat_corr_mat = None
 
         self.drop_cols = None
 
     @staticmethod
-    def cat_corr_matrix(X):
+    def num_corr_matrix(X, method='pearson') -> np.ndarray:
+        """ The absolute correlation matrix of the numerical columns as a numpy array """
+        arr = X.to_numpy(dtype=np.float64)
+        if method == 'pearson' and not np.isnan(arr).any():
+            with np.errstate(invalid='ignore', divide='ignore'):
+                corr_mat = np.atleast_2d(np.corrcoef(arr, rowvar=False))
+        else:
+            # pandas handles the missing values pairwise
+            corr_mat = X.corr(method=method).to_numpy()
+        return np.abs(corr_mat)
+
+    @staticmethod
+    def cat_corr_matrix(X, n_jobs=None):
+        """ The correlation between two categorical columns is the percentage of rows they are equal """
         n = X.shape[1]
         col_names = X.columns.tolist()
+
+        # factorize all the columns together so that equal values share the same code across columns
+        values = X.astype(object).fillna('_MISSING_').to_numpy()
+        codes = pd.factorize(values.ravel())[0].reshape(values.shape).astype(np.int32)
+
+        def _agreement(i):
+            # the matrix is symmetric, only compare column i with the columns on its right
+            return (codes[:, i:] == codes[:, i:i+1]).mean(axis=0)
+
+        # numpy releases the GIL during the comparison, threads avoid copying the codes to each worker
+        rows = Parallel(n_jobs=n_jobs, prefer='threads')(delayed(_agreement)(i) for i in range(n))
+
         corr_mat = np.empty((n, n))
-        
-        def cat_corr(s1: pd.Series, s2: pd.Series):
-            return (s1.fillna('_MISSING_') == s2.fillna('_MISSING_')).mean()
-        
-        for i in range(n):
-            for j in range(i+1):
-                if i == j:
-                    corr_mat[i][j] = 1
-                corr_mat[i][j] = corr_mat[j][i] = cat_corr(X[col_names[i]], X[col_names[j]])
+        for i, row in enumerate(rows):
+            corr_mat[i, i:] = corr_mat[i:, i] = row
         return pd.DataFrame(corr_mat, index=col_names, columns=col_names)
 
+    @staticmethod
+    def _greedy_keep(corr_mat: np.ndarray, threshold) -> np.ndarray:
+        """ Walk through the columns in order, a column is kept only if its correlation with
+            all the previously kept columns is below the threshold. Return a boolean mask of the kept columns.
+        """
+        n = corr_mat.shape[0]
+        exceed = corr_mat > threshold
+        keep = np.ones(n, dtype=bool)
+        for j in range(1, n):
+            if (exceed[j, :j] & keep[:j]).any():
+                keep[j] = False
+        return keep
+
     def fit(self, X, y=None, **fit_params):
         """ Return the number of dropped columns """
         cols = self.cols or X.columns.tolist()
@@ -297,40 +340,28 @@ class CorrelationRemover(BaseEstimator, TransformerMixin):
             raise ValueError('Sorting method not supported.')
 
         # make sure the categorical column actually exist in DataFrame X
+        cols_set = set(cols)
         categorical_cols = self.categorical_cols or \
-                           [c for c in X.select_dtypes(include=['object']).columns if c in cols]
+                           [c for c in X.select_dtypes(include=['object']).columns if c in cols_set]
         self.categorical_cols = categorical_cols
 
-        numerical_cols = [c for c in cols if c not in self.categorical_cols]
+        categorical_cols_set = set(categorical_cols)
+        numerical_cols = [c for c in cols if c not in categorical_cols_set]
 
         self.drop_cols = list()
 
         if numerical_cols:
-            num_corr_mat = X[numerical_cols].corr(method=self.method).abs()
-            
-            for i, c_a in enumerate(numerical_cols):
-                if c_a in self.drop_cols:
-                    continue
-                for j in range(i+1, len(numerical_cols)):
-                    c_b = numerical_cols[j]
-                    if c_b not in self.drop_cols and \
-                            num_corr_mat.loc[c_a, c_b] > self.threshold:
-                            self.drop_cols.append(c_b)
+            num_corr_mat = self.num_corr_matrix(X[numerical_cols], self.method)
+            keep = self._greedy_keep(num_corr_mat, self.threshold)
+            self.drop_cols.extend(numerical_cols[j] for j in np.flatnonzero(~keep))
             if self.save_corr:
-                self.num_corr_mat = num_corr_mat
+                self.num_corr_mat = pd.DataFrame(num_corr_mat, index=numerical_cols, columns=numerical_cols)
 
         if categorical_cols:
-            cat_corr_mat = self.cat_corr_matrix(X[categorical_cols]).abs()
-            
-            for i, c_a in enumerate(categorical_cols):
-                if c_a in self.drop_cols:
-                    continue
-                for j in range(i+1, len(categorical_cols)):
-                    c_b = categorical_cols[j]
-                    if c_b not in self.drop_cols and \
-                        cat_corr_mat.loc[c_a, c_b] > self.threshold:
-                            self.drop_cols.append(c_b)
-        
+            cat_corr_mat = self.cat_corr_matrix(X[categorical_cols], self.n_jobs).abs()
+            keep = self._greedy_keep(cat_corr_mat.to_numpy(), self.threshold)
+            self.drop_cols.extend(categorical_cols[j] for j in np.flatnonzero(~keep))
+
             if self.save_corr:
                 self.cat_corr_mat = cat_corr_mat
         return self
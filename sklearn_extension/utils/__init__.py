@@ -1,5 +1,4 @@
-from sklearn.preprocessing import LabelBinarizer
-from sklearn.utils import column_or_1d, is_scalar_nan
+from sklearn.utils import column_or_1d
 import pandas as pd
 import numpy as np
 import warnings
@@ -11,9 +10,11 @@ def force_zero_one(y):
     ex. [-1, 1, -1, -1, 1] => [0, 1, 0, 0, 1]
     """
     y = column_or_1d(y, warn=True)
-    if len(set(y)) != 2:
+    unique = np.unique(y)
+    if unique.size != 2:
         raise ValueError('The label should have exactly two categories')
-    return LabelBinarizer().fit_transform(y).ravel()
+    # same as LabelBinarizer, the larger label is the positive class
+    return (y == unique[1]).astype(int)
 
 
 def make_series(i, reset_index=True) -> pd.Series:
@@ -29,36 +30,30 @@ def make_series(i, reset_index=True) -> pd.Series:
 
 
 def map_series(X: pd.Series, mapping: dict, unseen=0, fill=-99):
-    def _map(x):
-        if is_scalar_nan(x):
-            return fill
-        else:
-            return mapping.get(x, unseen)
-    return X.map(_map)
-
-
-def _searchsorted(a, v):
-    """ Same as np.searchsorted(a, v, side='left') but faster for our purpose."""
-    for i, c in enumerate(a):
-        if c > v:
-            return i
-    else:
-        return len(a)
+    """ Map the values in X with mapping, missing values are encoded with fill
+        and values not in the mapping are encoded with unseen
+    """
+    encoded = X.map(mapping).fillna(unseen).where(X.notna(), fill)
+    # the dtype is lost when unseen or missing values exist, restore it from the mapping values
+    dtype = pd.Series(list(mapping.values()) + [unseen, fill]).dtype
+    return encoded.astype(dtype)
 
 
 def searchsorted(a, v, fill=-1):
     """ Encode values in v with ascending cutoff points in a. Similar to numpy.searchsorted
         Left open right close except for the leftmost interval, which is close at both ends.
+        Return an int64 numpy array with the same length as v.
     """
-    encoded = list()
-    for value in v:
-        if is_scalar_nan(value):
-            encoded.append(fill)
-        elif value == min(a):
-            # the leftmost interval close at both ends
-            encoded.append(1)
-        else:
-            encoded.append(_searchsorted(a, value))
+    a, v = np.asarray(a), np.asarray(v)
+    nan_mask = pd.isna(v)
+    if nan_mask.any():
+        # temporarily replace the missing values so that they can be compared with the cutoff points
+        v = np.where(nan_mask, a[0], v)
+
+    encoded = np.searchsorted(a, v, side='right').astype(np.int64, copy=False)
+    # the leftmost interval close at both ends
+    encoded[v == a[0]] = 1
+    encoded[nan_mask] = fill
     return encoded
 
 
@@ -67,26 +62,17 @@ def assign_group(x, bins):
         which take the left cutoff value
         ex. assign_group(range(6), [0, 2, 4]) => [0, 2, 2, 4, 4, np.inf]
     """
-    # add infinite at the end
-    bins = np.array(bins)
-    groups = list()
-    for v in x:
-        if is_scalar_nan(v):
-            groups.append(v)
-
-        elif v <= bins[0]:
-            groups.append(bins[0])
-            continue
-        
-        else:    
-            # find the cutoff value that's larger or equal than the current value
-            idx = np.argmax(bins >= v)
-            if idx > 0:
-                groups.append(bins[idx])
-            else:
-                # none of the cutoff points is larger than the value
-                groups.append(np.inf)            
-    return groups
+    bins = np.asarray(bins, dtype=np.float64)
+    x = np.asarray(x, dtype=np.float64)
+
+    # find the cutoff value that's larger or equal than the current value,
+    # values larger than all the cutoff points land on the appended infinite
+    idx = np.searchsorted(bins, x, side='left')
+    groups = np.append(bins, np.inf)[idx]
+    groups[x <= bins[0]] = bins[0]
+    # propagate the missing values
+    groups[np.isnan(x)] = np.nan
+    return groups.tolist()
 
 
 def wrap_with_inf(bins):
@@ -103,8 +89,16 @@ def encode_with_nearest_key(series: pd.Series, key):
     try:
         return series[key]
     except KeyError:
-        nearest_key_idx = np.abs((series.index - key)).argmin()
-        return series[series.index[nearest_key_idx]]
+        if not series.index.is_monotonic_increasing:
+            nearest_key_idx = np.abs((series.index - key)).argmin()
+            return series.iat[nearest_key_idx]
+
+        # binary search on the sorted index, then pick the closer of the two neighbours
+        index = series.index.to_numpy()
+        pos = np.searchsorted(index, key)
+        left, right = max(pos - 1, 0), min(pos, len(index) - 1)
+        nearest_key_idx = right if abs(index[right] - key) < abs(index[left] - key) else left
+        return series.iat[nearest_key_idx]
 
 
 def encode_with_default_value(series: pd.Series, key, default=0):
@@ -53,6 +53,26 @@ def ngram(iterable, n=2):
             q.popleft()
 
 
+def ngram_array(arr, n=2):
+    """ All the n-grams of a 1-d array as a read-only 2-d view with shape (len(arr) - n + 1, n).
+        The view shares memory with arr, no data is copied.
+    """
+    import numpy as np
+
+    arr = np.asarray(arr)
+    if arr.ndim != 1:
+        raise ValueError('Only 1-d array is supported, get an array with {} dimensions.'.format(arr.ndim))
+    if len(arr) < n:
+        return np.empty((0, n), dtype=arr.dtype)
+
+    stride_tricks = np.lib.stride_tricks
+    if hasattr(stride_tricks, 'sliding_window_view'):
+        return stride_tricks.sliding_window_view(arr, n)
+    # numpy < 1.20
+    return stride_tricks.as_strided(arr, shape=(len(arr) - n + 1, n),
+                                    strides=arr.strides * 2, writeable=False)
+
+
 def set_default(criteria=None, default_value=None):
     """ A decorator that checks the first argument, if meets the criteria then replace it with default_value
         The criteria can be a list of values or a callable that returns boolean. Default is [None]
@@ -105,9 +125,16 @@ def return_default(criteria=None, default_value=None):
 def flatten_list(nested_list):
     """ Flatten a nested list regardless of the depth."""
     flattened_list = list()
-    for elem in nested_list:
+    # keep a stack of iterators instead of recursing into each sublist
+    stack = [iter(nested_list)]
+    while stack:
+        try:
+            elem = next(stack[-1])
+        except StopIteration:
+            stack.pop()
+            continue
         if isinstance(elem, (list, tuple)):
-            flattened_list.extend(flatten_list(elem))
+            stack.append(iter(elem))
         else:
             flattened_list.append(elem)
     return flattened_list
@@ -145,15 +172,16 @@ def to_hash(value):
     """
     Hashes values for hashing trick.
     Treats numbers as strings.
+    Uses the non-cryptographic 64-bit xxhash, which requires the xxhash package.
 
     :param value: Any value that should be trated as category.
     :return: hashed value.
     """
+    import xxhash
+
     if not isinstance(value, bytes):
         value = str(value).encode('utf-8')
-    hex_value = sha256(value).hexdigest()
-    int_hash = int(hex_value, 16)
-    return int_hash
+    return xxhash.xxh64_intdigest(value)
 
 
 class Timer(object):